@@ -15,6 +15,7 @@ class BH1750:
         self.addr = addr
         self.mode = measurement_mode
         self.bus = SMBus(self.busnum)
+        self._rx_msg = i2c_msg.read(self.addr, 2)
         self._power_on()
         self._reset()
         self.set_mode(self.mode)
@@ -36,22 +37,23 @@ class BH1750:
         time.sleep(0.18)
 
     def read_raw(self):
-        read = i2c_msg.read(self.addr, 2)
-        self.bus.i2c_rdwr(read)
-        data = list(read)
-        if len(data) != 2:
+        self.bus.i2c_rdwr(self._rx_msg)
+        buf = bytes(self._rx_msg)
+        if len(buf) != 2:
             raise IOError("I2C read returned wrong number of bytes")
-        return (data[0] << 8) | data[1]
+        return (buf[0] << 8) | buf[1]
 
     def read_lux_once(self):
         self.bus.write_byte(self.addr, ONE_TIME_H_RES_MODE)
         time.sleep(0.18)
         raw = self.read_raw()
-        return raw / 1.2
+        #raw / 1.2 rounded to the nearest integer; H-res mode only resolves ~1 lx anyway
+        return (raw * 5 + 3) // 6
 
     def read_lux(self):
         raw = self.read_raw()
-        return raw / 1.2
+        #raw / 1.2 rounded to the nearest integer; H-res mode only resolves ~1 lx anyway
+        return (raw * 5 + 3) // 6
 
 def parse_args():
     p = argparse.ArgumentParser(description="Read BH1750 on Raspberry Pi (pins 1,3,5,9 -> 3.3V,SDA,SCL,GND)")
@@ -72,7 +74,7 @@ def main():
     if args.once:
         try:
             lux = sensor.read_lux_once()
-            print(f"{lux:.2f} lx")
+            print(f"{lux} lx")
         except Exception as e:
             print("Read failed:", e, file=sys.stderr)
             sys.exit(3)
@@ -83,7 +85,7 @@ def main():
         while True:
             try:
                 lux = sensor.read_lux()
-                print(f"{time.strftime('%Y-%m-%d %H:%M:%S')}  {lux:.2f} lx")
+                print(f"{time.strftime('%Y-%m-%d %H:%M:%S')}  {lux} lx")
             except Exception as e:
                 print("Read failed:", e, file=sys.stderr)
             printed += 1
@@ -1,16 +1,19 @@
+import os
 import time
 import csv
 import argparse
 import sys
 import signal
 import threading
+import ctypes
+import ctypes.util
 from pathlib import Path
-from datetime import datetime, timezone
-from queue import Queue, Empty
-import statistics
-import json
+from datetime import datetime
+from queue import SimpleQueue
+import numpy as np
 
 logging_interval = 20.0
+max_write_batch = 8
 
 try:
     from BH1750_test import BH1750, parse_args as original_parse_args
@@ -18,12 +21,48 @@ except ImportError:
     print("Error: Could not import BH1750_test.py. Ensure it's in the same directory.", file=sys.stderr)
     sys.exit(1)
 
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+class _itimerspec(ctypes.Structure):
+    _fields_ = [('it_interval', _timespec), ('it_value', _timespec)]
+
+def _libc_timerfd(interval):
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    tfd = libc.timerfd_create(time.CLOCK_MONOTONIC, os.O_CLOEXEC)
+    if tfd < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    sec, nsec = divmod(int(interval * 1e9), 1_000_000_000)
+    spec = _itimerspec(_timespec(sec, nsec), _timespec(sec, nsec))
+    if libc.timerfd_settime(tfd, 0, ctypes.byref(spec), None) < 0:
+        err = ctypes.get_errno()
+        os.close(tfd)
+        raise OSError(err, os.strerror(err))
+    return tfd
+
+def _mad_filter(readings):
+    m = np.median(readings)
+    devs = np.abs(readings - m)
+    mad = np.median(devs)
+    if mad == 0:
+        threshold = 2.0
+    else:
+        threshold = 3.0 * 1.4826 * mad
+    filtered = readings[devs <= threshold]
+    if filtered.size == 0:
+        filtered = readings
+    return np.median(filtered), filtered
+
 class CSVLightLogger:
-    def __init__(self, filename=None, interval=None, bus=1, addr=0x23, buffer_size=100, include_stats=True):
+    def __init__(self, filename=None, interval=None, bus=1, addr=0x23, buffer_size=100, include_stats=True, fsync_every=0):
         self.interval = logging_interval if interval is None else interval
         self.buffer_size = buffer_size
         self.include_stats = include_stats
+        self.fsync_every = fsync_every
         self.running = False
+        self._worker = None
+        self._shutdown_fd = os.eventfd(0, os.EFD_CLOEXEC)
         try:
             self.sensor = BH1750(bus=bus, addr=addr)
         except Exception as e:
@@ -35,6 +74,14 @@ class CSVLightLogger:
         self.readings_per_interval = max(1, min(5, int(self.interval / 8) + 1))
         self.sample_delay = 0.1
         self.max_consecutive_errors = 5
+        self.lux_buf = np.empty(self.readings_per_interval, dtype=np.float64)
+        self._write_batch = max(1, min(max_write_batch, int(1.0 / self.interval)))
+        self._pending_rows = []
+        self._dirty_count = 0
+        self._writeback_queue = SimpleQueue()
+        self._writeback_worker = None
+        self._csv_lock = threading.Lock()
+        self._format_row = self._build_formatter(include_stats)
         self._initialize_csv()
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
@@ -43,68 +90,159 @@ class CSVLightLogger:
         headers = ['timestamp', 'iso_timestamp', 'lux_value']
         if self.include_stats:
             headers.extend(['min_lux_1min', 'max_lux_1min', 'avg_lux_1min', 'std_lux_1min', 'sample_count'])
-        with open(self.csv_path, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(headers)
+        self._open_csv(os.O_TRUNC)
+        os.write(self._fd, (','.join(headers) + '\r\n').encode('ascii'))
         print(f"CSV logging initialized: {self.csv_path}")
         if self.include_stats:
             print("Statistical analysis enabled (trimmed/median style)")
 
+    def _open_csv(self, extra_flags=0):
+        self._fd = os.open(str(self.csv_path), os.O_WRONLY | os.O_CREAT | os.O_APPEND | extra_flags, 0o644)
+        self._dirty_count = 0
+        if self.fsync_every > 0:
+            self._writeback_worker = threading.Thread(target=self._writeback_thread, args=(self._fd,), daemon=True)
+            self._writeback_worker.start()
+
+    def _build_formatter(self, include_stats):
+        if not include_stats:
+            fmt = b"%d,%s,%d\r\n"
+            return lambda ts, iso, lux, filtered: fmt % (ts, iso, lux)
+        fmt = b"%d,%s,%d,%d,%d,%d,%d,%d\r\n"
+        calculate_stats = self._calculate_stats
+        def format_row(ts, iso, lux, filtered):
+            vmin, vmax, vmid, vstdev = calculate_stats(filtered)
+            if vmin is None:
+                return fmt % (ts, iso, lux, lux, lux, lux, 0, 0)
+            return fmt % (ts, iso, lux, vmin, vmax, vmid, vstdev, len(filtered))
+        return format_row
+
+    def _write_row(self, line):
+        with self._csv_lock:
+            if self._fd is None:
+                return
+            self._pending_rows.append(line)
+            if len(self._pending_rows) >= self._write_batch:
+                self._flush_rows()
+
+    def _flush_rows(self):
+        if self._pending_rows:
+            os.writev(self._fd, self._pending_rows)
+            self._dirty_count += len(self._pending_rows)
+            self._pending_rows.clear()
+            if self._writeback_worker is not None and self._dirty_count >= self.fsync_every:
+                self._dirty_count = 0
+                self._writeback_queue.put(True)
+
+    def _writeback_thread(self, fd):
+        while self._writeback_queue.get():
+            try:
+                os.fdatasync(fd)
+            except OSError as e:
+                print(f"CSV fdatasync failed: {e}", file=sys.stderr)
+
+    def _close_csv(self):
+        with self._csv_lock:
+            if self._fd is not None:
+                self._flush_rows()
+                if self._writeback_worker is not None:
+                    self._writeback_queue.put(True)
+                    self._writeback_queue.put(False)
+                    self._writeback_worker.join()
+                os.close(self._fd)
+                self._fd = None
+
     def _signal_handler(self, signum, frame):
         print(f"\nReceived signal {signum}, shutting down gracefully...")
         self.stop()
 
     def _calculate_stats(self, values):
-        if not values:
+        n = len(values)
+        if n == 0:
             return None, None, None, None
-        vmin = int(round(min(values)))
-        vmax = int(round(max(values)))
-        median = int(round(statistics.median(values)))
-        stdev = int(round(statistics.stdev(values))) if len(values) > 1 else 0
-        return vmin, vmax, median, stdev
+        arr = values.astype(np.int64)
+        total = int(arr.sum())
+        total_sq = int((arr * arr).sum())
+        median = int(round(np.median(arr)))
+        stdev = int(round(((n * total_sq - total * total) / (n * (n - 1))) ** 0.5)) if n > 1 else 0
+        return int(arr.min()), int(arr.max()), median, stdev
 
     def _aggregate_readings(self, readings):
-        if not readings:
+        if len(readings) == 0:
             return None
-        if len(readings) == 1:
-            return int(round(readings[0])), [readings[0]]
-        m = statistics.median(readings)
-        devs = [abs(x - m) for x in readings]
-        mad = statistics.median(devs)
-        if mad == 0:
-            threshold = 2.0
-        else:
-            threshold = 3.0 * 1.4826 * mad
-        filtered = [x for x in readings if abs(x - m) <= threshold]
-        if not filtered:
-            filtered = readings
-        rep = int(round(statistics.median(filtered)))
-        return rep, filtered
+        arr = np.asarray(readings, dtype=np.float64)
+        if arr.size == 1:
+            return int(arr[0]), arr
+        rep, filtered = _mad_filter(arr)
+        return int(round(rep)), filtered
+
+    def _open_interval_timer(self):
+        try:
+            if hasattr(os, 'timerfd_create'):
+                tfd = os.timerfd_create(time.CLOCK_MONOTONIC, flags=os.TFD_CLOEXEC)
+                os.timerfd_settime(tfd, initial=self.interval, interval=self.interval)
+            else:
+                tfd = _libc_timerfd(self.interval)
+        except (OSError, AttributeError) as e:
+            print(f"timerfd unavailable, falling back to sleep pacing: {e}", file=sys.stderr)
+            return None
+        return tfd
+
+    def _set_realtime_priority(self):
+        if not hasattr(os, 'sched_setscheduler'):
+            return
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(20))
+        except OSError as e:
+            print(f"Realtime scheduling unavailable, using default scheduler: {e}")
+            return
+        try:
+            os.sched_setaffinity(0, {max(os.sched_getaffinity(0))})
+        except OSError as e:
+            print(f"SCHED_FIFO enabled; CPU pinning unavailable: {e}")
 
     def _read_and_log_loop(self):
+        self._set_realtime_priority()
+        tfd = self._open_interval_timer()
+        try:
+            self._run_loop(tfd)
+        finally:
+            if tfd is not None:
+                os.close(tfd)
+
+    def _run_loop(self, tfd):
+        read_lux = self.sensor.read_lux
+        lux_buf = self.lux_buf
+        readings_per_interval = self.readings_per_interval
+        sample_delay = self.sample_delay
+        max_consecutive_errors = self.max_consecutive_errors
+        format_row = self._format_row
+        interval_ns = int(self.interval * 1e9)
         consecutive_errors = 0
-        next_time = time.time()
+        next_ns = time.monotonic_ns()
         while self.running:
             try:
-                samples = []
-                for _ in range(self.readings_per_interval):
+                n_valid = 0
+                last_ts = 0
+                for _ in range(readings_per_interval):
                     try:
-                        lux = self.sensor.read_lux()
-                        samples.append(lux)
+                        lux_buf[n_valid] = read_lux()
+                        last_ts = time.time()
+                        n_valid += 1
                         consecutive_errors = 0
                     except Exception as e:
                         consecutive_errors += 1
-                        print(f"Sensor read error ({consecutive_errors}/{self.max_consecutive_errors}): {e}", file=sys.stderr)
-                        if consecutive_errors >= self.max_consecutive_errors:
+                        print(f"Sensor read error ({consecutive_errors}/{max_consecutive_errors}): {e}", file=sys.stderr)
+                        if consecutive_errors >= max_consecutive_errors:
                             print("Too many consecutive errors, stopping logger", file=sys.stderr)
                             self.running = False
+                            os.eventfd_write(self._shutdown_fd, 1)
                             break
-                    if len(samples) < self.readings_per_interval:
-                        time.sleep(self.sample_delay)
+                    if n_valid < readings_per_interval:
+                        time.sleep(sample_delay)
                 if not self.running:
                     break
-                valid = [s for s in samples if s is not None]
-                if valid:
+                if n_valid:
+                    valid = lux_buf[:n_valid]
                     agg = self._aggregate_readings(valid)
                     if agg is None:
                         representative = None
@@ -115,26 +253,21 @@ class CSVLightLogger:
                         representative = int(round(agg))
                         filtered = valid
                     if representative is not None:
-                        ts = int(time.time())
-                        iso = datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
-                        row = [ts, iso, representative]
-                        if self.include_stats:
-                            stats = self._calculate_stats(filtered)
-                            if stats[0] is None:
-                                row.extend([representative, representative, representative, 0, len(filtered)])
-                            else:
-                                vmin, vmax, vmid, vstdev = stats
-                                row.extend([vmin, vmax, vmid, vstdev, len(filtered)])
-                        with open(self.csv_path, 'a', newline='') as csvfile:
-                            writer = csv.writer(csvfile)
-                            writer.writerow(row)
+                        ts = int(last_ts)
+                        iso = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(ts))
+                        self._write_row(format_row(ts, iso.encode('ascii'), representative, filtered))
                         print(f"{iso} - {representative} lx")
-                next_time += self.interval
-                sleep_for = next_time - time.time()
-                if sleep_for > 0:
-                    time.sleep(sleep_for)
+                if tfd is not None:
+                    expirations = int.from_bytes(os.read(tfd, 8), sys.byteorder)
+                    if expirations > 1:
+                        print(f"Logging loop overran by {expirations - 1} interval(s)", file=sys.stderr)
+                    continue
+                next_ns += interval_ns
+                delta = next_ns - time.monotonic_ns()
+                if delta > 0:
+                    time.sleep(delta / 1e9)
                 else:
-                    next_time = time.time()
+                    next_ns = time.monotonic_ns()
             except Exception as e:
                 print(f"Logging loop error: {e}", file=sys.stderr)
                 time.sleep(1.0)
@@ -142,23 +275,30 @@ class CSVLightLogger:
     def start(self):
         if self.running:
             return
+        if self._worker is not None:
+            self._worker.join()
+        if self._fd is None:
+            self._open_csv()
+        if self._shutdown_fd is None:
+            self._shutdown_fd = os.eventfd(0, os.EFD_CLOEXEC)
         self.running = True
         print(f"Starting light sensor logging every {self.interval} seconds (readings per interval: {self.readings_per_interval})...")
         print(f"Data file: {self.csv_path}")
         print("Press Ctrl+C to stop")
-        worker = threading.Thread(target=self._read_and_log_loop, daemon=True)
-        worker.start()
-        try:
-            while self.running:
-                time.sleep(1)
-        except KeyboardInterrupt:
-            self.stop()
+        self._worker = threading.Thread(target=self._read_and_log_loop, daemon=True)
+        self._worker.start()
+        os.read(self._shutdown_fd, 8)
+        self._close_csv()
+        os.close(self._shutdown_fd)
+        self._shutdown_fd = None
 
     def stop(self):
         if not self.running:
             return
         print("Stopping logger...")
         self.running = False
+        os.eventfd_write(self._shutdown_fd, 1)
+        self._close_csv()
         if self.csv_path.exists():
             try:
                 with open(self.csv_path, 'r') as f:
@@ -180,18 +320,20 @@ Examples:
   %(prog)s -f light_data.csv        #Log to specific file
   %(prog)s --no-stats               #Disable statistical analysis
   %(prog)s --addr 0x5c --bus 0      #Use different I2C address/bus
+  %(prog)s --fsync-every 3          #Flush rows to disk every 3 records
         """)
     parser.add_argument('-f', '--filename', type=str, help='CSV filename (default: auto-generated with timestamp)')
     parser.add_argument('--addr', type=lambda x: int(x,0), default=0x23, help='I2C address (default: 0x23)')
     parser.add_argument('--bus', type=int, default=1, help='I2C bus number (default: 1)')
     parser.add_argument('--buffer-size', type=int, default=100, help='Internal buffer size (default: 100)')
     parser.add_argument('--no-stats', action='store_true', help='Disable statistical analysis')
+    parser.add_argument('--fsync-every', type=int, default=0, help='fdatasync the CSV after this many rows from a background thread (default: 0, disabled)')
     return parser.parse_args()
 
 def main():
     args = parse_csv_args()
     try:
-        logger = CSVLightLogger(filename=args.filename, interval=logging_interval, bus=args.bus, addr=args.addr, buffer_size=args.buffer_size, include_stats=not args.no_stats)
+        logger = CSVLightLogger(filename=args.filename, interval=logging_interval, bus=args.bus, addr=args.addr, buffer_size=args.buffer_size, include_stats=not args.no_stats, fsync_every=args.fsync_every)
         logger.start()
     except KeyboardInterrupt:
         print("\nInterrupted by user")